@@ -0,0 +1,278 @@
+'''
+Description:
+    A folder of binary sidecars holding parsed (and perhaps cast) records so
+    that repeatedly read files need not be parsed again.
+
+    Sidecars are columnar (integer and float columns are packed arrays, string columns
+    a single encoded block) so that they can be memory mapped and decoded in bulk.
+    Each is validated against the size, modification time and content hash of its
+    source; the folder is kept below a size limit by evicting the least recently used.
+
+    Sidecars may hold pickles, so the folder must be private: it is created for the user
+    alone (by default, under the user's cache directory) and refused if anyone else owns
+    or can write to it.
+'''
+# standard
+from array import array
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import unittest
+
+MAGIC = b'NITS\x01'
+SEPARATOR = '\x00' # joins string columns; columns containing it are pickled instead
+SUFFIX = '.nits'
+DEFAULT_FOLDER = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'nits')
+DEFAULT_LIMIT = 2**30 # bytes
+INT64 = (-2**63, 2**63 - 1)
+
+def digest(filename, block=2**20):
+    '''
+    content hash of a file
+    '''
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def private(folder):
+    '''
+    create a folder only the user can use, or check that an existing one is only theirs
+    '''
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'): # POSIX
+        stat = os.stat(folder)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise PermissionError('cache folder is not private to the user: ' + folder)
+    return folder
+
+def _pad(n):
+    return -n % 8
+
+def encode(column):
+    '''
+    pack a column of values into (kind, nulls, data) where kind is:
+
+    - q: 64 bit integers
+    - d: 64 bit floats
+    - s: strings
+    - p: anything else (pickled), including larger integers and mixed integers and floats,
+      which would not survive as 64 bit floats
+    '''
+    nulls = bytes(x is None for x in column) if None in column else b''
+    present = [x for x in column if x is not None]
+    kinds = set(type(x) for x in present)
+    if kinds <= {int} and all(INT64[0] <= x <= INT64[1] for x in present):
+        return 'q', nulls, array('q', [0 if x is None else x for x in column]).tobytes()
+    elif kinds == {float}:
+        return 'd', nulls, array('d', [0. if x is None else x for x in column]).tobytes()
+    elif kinds <= {str} and not any(SEPARATOR in x for x in present):
+        return 's', nulls, SEPARATOR.join('' if x is None else x for x in column).encode('utf-8')
+    else:
+        return 'p', b'', pickle.dumps(column, pickle.HIGHEST_PROTOCOL)
+
+def decode(kind, nulls, data, rows):
+    '''
+    unpack a column packed by `encode`
+    '''
+    if kind in 'qd':
+        column = array(kind)
+        column.frombytes(data)
+        column = column.tolist()
+    elif kind == 's':
+        column = data.decode('utf-8').split(SEPARATOR) if rows else []
+    else:
+        return pickle.loads(data)
+    if nulls:
+        column = [None if null else x for x, null in zip(column, nulls)]
+    return column
+
+class Cache:
+    '''
+    A size limited folder of binary sidecars keyed by source file and read options
+    '''
+
+    def __init__(self,
+        folder=DEFAULT_FOLDER,
+        limit=DEFAULT_LIMIT,
+        verify=True):
+        '''
+        - folder: where to keep the sidecars (private to the user, see private)
+        - limit: maximum total size of the sidecars (in bytes)
+        - verify: also validate sidecars against a content hash of the source
+        '''
+        self.folder, self.limit, self.verify = private(folder), limit, verify
+
+    def path(self, filename, options):
+        '''
+        sidecar file name for a source file read with (a repr-able collection of) options
+        '''
+        key = repr((os.path.abspath(filename), options)).encode('utf-8')
+        return os.path.join(self.folder, hashlib.sha1(key).hexdigest() + SUFFIX)
+
+    def source(self, filename):
+        '''
+        description of the source file used to validate its sidecar
+        '''
+        stat = os.stat(filename)
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': digest(filename) if self.verify else None,
+            'byteorder': sys.byteorder}
+
+    def fetch(self, filename, options, parse):
+        '''
+        return (fields, records) from the sidecar when it is valid,
+        otherwise from parse() -- storing the records once they have all been read
+        '''
+        source = self.source(filename)
+        path = self.path(filename, options)
+        loaded = self.load(path, source)
+        if loaded is not None:
+            return loaded
+        fields, records = parse()
+        return fields, self._storing(path, source, fields, records)
+
+    def _storing(self, path, source, fields, records):
+        rows = []
+        for record in records:
+            rows.append(record)
+            yield record
+        self.store(path, source, fields, rows)
+
+    def load(self, path, source):
+        '''
+        return (fields, records) from a sidecar, or None if it is missing or stale
+        '''
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(MAGIC)] != MAGIC:
+                    return None
+                start = len(MAGIC) + 8
+                size, = struct.unpack('<Q', mm[len(MAGIC):start])
+                header = json.loads(mm[start:start + size].decode('utf-8'))
+                if header['source'] != source:
+                    return None
+                base = start + size + _pad(start + size)
+                def block(offset, length):
+                    return mm[base + offset:base + offset + length]
+                n = header['rows']
+                if header['jagged']:
+                    rows = pickle.loads(block(*header['columns'][0]['data']))
+                else:
+                    columns = [decode(c['kind'], block(*c['nulls']), block(*c['data']), n)
+                        for c in header['columns']]
+                    rows = [list(row) for row in zip(*columns)] if columns else [[] for _ in range(n)]
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(path) # most recently used
+        return header['fields'], rows
+
+    def store(self, path, source, fields, rows):
+        '''
+        write records to a sidecar (atomically) and evict old sidecars
+        '''
+        widths = set(len(row) for row in rows)
+        jagged = len(widths) > 1
+        if jagged:
+            packed = [('p', b'', pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))]
+        else:
+            packed = [encode(list(column)) for column in zip(*rows)]
+        blocks, columns, offset = [], [], 0
+        for kind, nulls, data in packed:
+            column = {'kind': kind}
+            for name, chunk in [('nulls', nulls), ('data', data)]:
+                column[name] = [offset, len(chunk)]
+                blocks += [chunk, b'\x00' * _pad(len(chunk))]
+                offset += len(chunk) + _pad(len(chunk))
+            columns.append(column)
+        header = json.dumps({
+            'source': source,
+            'fields': fields,
+            'rows': len(rows),
+            'jagged': jagged,
+            'columns': columns}).encode('utf-8')
+        start = len(MAGIC) + 8 + len(header)
+        descriptor, temporary = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(header)) + header + b'\x00' * _pad(start))
+            for chunk in blocks:
+                f.write(chunk)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        '''
+        remove the least recently used sidecars until the folder is within its limit
+        '''
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+class Test_Cache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = Cache(self.folder.name)
+        self.source = os.path.join(self.folder.name, 'source.txt')
+        with open(self.source, 'w') as f:
+            f.write('source')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_columns(self):
+        for column in [[1, None, -3], [1.5, None], [1.5, 2], ['a', '', None], ['a', 1], [2**70],
+            [12345678901234567891, -3], []]:
+            kind, nulls, data = encode(column)
+            decoded = decode(kind, nulls, data, len(column))
+            assert decoded == column and [type(x) for x in decoded] == [type(x) for x in column]
+
+    def test_fetch(self):
+        rows = [[1, 'a', 1.5], [2, None, None]]
+        def parse():
+            return ['i', 's', 'x'], iter(rows)
+        for _ in range(2):
+            fields, records = self.cache.fetch(self.source, 'options', parse)
+            assert fields == ['i', 's', 'x'] and list(records) == rows
+        path = self.cache.path(self.source, 'options')
+        assert self.cache.load(path, self.cache.source(self.source)) == (fields, rows)
+        with open(self.source, 'w') as f:
+            f.write('changed')
+        assert self.cache.load(path, self.cache.source(self.source)) is None
+
+    def test_private(self):
+        shared = os.path.join(self.folder.name, 'shared')
+        assert private(shared) == shared and os.stat(shared).st_mode & 0o777 == 0o700
+        if hasattr(os, 'getuid'):
+            os.chmod(shared, 0o777)
+            with self.assertRaises(PermissionError):
+                Cache(shared)
+
+    def test_evict(self):
+        small = Cache(self.folder.name, limit=0)
+        fields, records = small.fetch(self.source, 'options', lambda: (None, iter([[1, 2]])))
+        assert list(records) == [[1, 2]]
+        assert not os.path.exists(small.path(self.source, 'options'))
+
+if __name__ == '__main__':
+    unittest.main()
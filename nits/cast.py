@@ -138,8 +138,42 @@ class To():
 class Nones:
     numeric = cast(none(To.numeric))
     integer = cast(none(To.integer))
+    exact_integer = cast(none(int)) # as inferred: '2.5' is not an integer
     string = cast(none(str))
 
+for name in ['numeric', 'integer', 'exact_integer', 'string']: # name the closures for introspection
+    getattr(Nones, name).__qualname__ = 'Nones.' + name
+
+def infer(values):
+    '''
+    Return the narrowest cast which represents all of the sample string values:
+
+    - int, then float, then To.string
+    - a Nones cast (Nones.exact_integer for int) if any value is empty
+
+    Numeric casts are exact (large integers are not rounded through float)
+    and raise ValueError for values which do not fit, rather than guess.
+    '''
+    def all_of(f, values):
+        try:
+            for value in values:
+                f(value)
+        except ValueError:
+            return False
+        return True
+
+    values = list(values)
+    present = [value for value in values if value]
+    if not present:
+        return Nones.string
+    empty = len(present) < len(values)
+    if all_of(int, present):
+        return Nones.exact_integer if empty else int
+    elif all_of(float, present):
+        return Nones.numeric if empty else float
+    else:
+        return Nones.string if empty else To.string
+
 class Test_Cast(unittest.TestCase):
 
     def setUp(self):
@@ -179,6 +213,19 @@ class Test_Cast(unittest.TestCase):
         assert To.string(11) == '11'
         assert To.abs_integer('-1.03') == 1
 
+    def test_infer(self):
+        assert infer(['1', '22', '-3']) is int
+        assert infer(['1', '', '3']) is Nones.exact_integer
+        assert Nones.exact_integer('') is None
+        assert Nones.exact_integer('12345678901234567891') == 12345678901234567891
+        with self.assertRaises(ValueError):
+            Nones.exact_integer('2.5')
+        assert infer(['1', '2.5']) is float
+        assert infer(['1e3', '']) is Nones.numeric
+        assert infer(['1', 'x']) is To.string
+        assert infer(['', 'x']) is Nones.string
+        assert infer(['', '']) is Nones.string
+
     def test_hex_string(self):
         assert To.hex_string(1.) == To.hex_string(1) == To.hex_string('fF') == 'FF'
         assert To.hex_string() == To.hex_string(0) == To.hex_string(0.) == '00'
@@ -6,19 +6,39 @@ Description:
 Environment variables:
     - DOITPATH:  assign program folder
     - PYTHON: the python executable name (e.g. python3)
+    - DOITSOCKET: run python programs through the (warm) server listening on this socket
+      (python 3.9+ on POSIX; otherwise programs are simply started)
+    - DOITPRELOAD: comma separated modules the server imports before forking
 
 Usage:
     doit [<command>] [<parameter>...]
+    doit --serve [<module>...]
 
 Example(s):
     `doit something.py else.py -v --folder stuff`
+
+    Serve python programs from a process which has already imported numpy:
+
+    `DOITSOCKET=/tmp/doit.sock doit --serve numpy &`
+
+    `DOITSOCKET=/tmp/doit.sock doit something.py`
 '''
 
 # standard
+import importlib
+import json
 from pathlib import Path
 import os
+import runpy
+import signal
+import socket
+import stat
+import struct
 import subprocess
 import sys
+import traceback
+
+SERVES = hasattr(socket, 'send_fds') and hasattr(os, 'fork') # passing descriptors needs python 3.9+ (POSIX)
 
 EXECUTABLES = {
     'py':'python',
@@ -55,6 +75,129 @@ def find(code, folders):
             return filename
     return None
 
+def _receive(connection, size):
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+def _run(connection):
+    '''
+    within a forked server process: adopt the caller's stdio, folder, environment and arguments,
+    then run its program, returning the exit status
+    '''
+    message, descriptors, _, _ = socket.recv_fds(connection, 8, 3)
+    request = json.loads(_receive(connection, struct.unpack('<Q', message)[0]).decode('utf-8'))
+    connection.sendall(struct.pack('<i', os.getpid()))
+    for stream in (sys.stdout, sys.stderr):
+        stream.flush()
+    for target, descriptor in enumerate(descriptors):
+        os.dup2(descriptor, target)
+        os.close(descriptor)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['environment'])
+    sys.argv = [request['program']] + request['argv']
+    sys.path[0] = os.path.dirname(os.path.abspath(request['program']))
+    try:
+        runpy.run_path(request['program'], run_name='__main__')
+        status = 0
+    except SystemExit as exit:
+        if exit.code is None or isinstance(exit.code, int):
+            status = exit.code or 0
+        else:
+            print(exit.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    for stream in (sys.stdout, sys.stderr):
+        stream.flush()
+    return status
+
+def _listening(path):
+    '''
+    is a server listening on the socket at path?
+    '''
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            return False
+    return True
+
+def serve(path, modules=()):
+    '''
+    import modules, then fork a (warm) process to run each python program requested on the socket,
+    replacing a socket left by a server no longer listening (but nothing else)
+    '''
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            raise FileExistsError('not a socket: ' + path)
+        elif _listening(path):
+            raise FileExistsError('a server is already listening on ' + path)
+        os.remove(path)
+    for module in modules:
+        importlib.import_module(module)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(64)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN) # reap finished children
+    while True:
+        connection, _ = server.accept()
+        if hasattr(socket, 'SO_PEERCRED'): # only serve our own user
+            _, uid, _ = struct.unpack('3i',
+                connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+            if uid != os.getuid():
+                connection.close()
+                continue
+        if os.fork() == 0:
+            server.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                status = _run(connection)
+                connection.sendall(struct.pack('<i', status))
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        connection.close()
+
+def request(path, program, argv):
+    '''
+    run a python program through the server, returning its exit status (None if there is no server)
+    '''
+    if not SERVES:
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        return None
+    with connection:
+        payload = json.dumps({
+            'program': os.path.abspath(program),
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'environment': dict(os.environ)}).encode('utf-8')
+        socket.send_fds(connection, [struct.pack('<Q', len(payload))], [0, 1, 2])
+        connection.sendall(payload)
+        try:
+            pid, = struct.unpack('<i', _receive(connection, 4))
+            def forward(number, frame):
+                os.kill(pid, number)
+            for number in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+                signal.signal(number, forward)
+            status, = struct.unpack('<i', _receive(connection, 4))
+        except EOFError:
+            status = 1
+    return status
+
 def process():
     if 'DOITPATH' in os.environ:
         EXECUTABLES['doit'] = os.environ['DOITPATH'].split(':')
@@ -63,14 +206,32 @@ def process():
     if 'SHELL' in os.environ:
         EXECUTABLES['sh'] = os.environ['SHELL']
 
+    path = os.environ.get('DOITSOCKET')
+
     if len(sys.argv) < 2:
         show(EXECUTABLES['doit'])
+    elif sys.argv[1] == '--serve':
+        if path is None:
+            sys.exit('--serve requires DOITSOCKET')
+        elif not SERVES:
+            sys.exit('--serve requires python 3.9+ on a POSIX system')
+        preload = [m for m in os.environ.get('DOITPRELOAD', '').split(',') if m]
+        try:
+            serve(path, preload + sys.argv[2:])
+        except FileExistsError as error:
+            sys.exit(str(error))
     else:
         command = find(sys.argv[1], EXECUTABLES['doit'])
         if command is None:
             show(EXECUTABLES['doit'])
         else:
-            subprocess.Popen([EXECUTABLES[command.split('.')[-1]]] + [command] + sys.argv[2:]).wait()
+            status = None
+            if path is not None and command.split('.')[-1] == 'py':
+                status = request(path, command, sys.argv[2:])
+            if status is None:
+                status = subprocess.Popen(
+                    [EXECUTABLES[command.split('.')[-1]]] + [command] + sys.argv[2:]).wait()
+            sys.exit(status)
 
 if __name__ == '__main__':
     process()
@@ -1,9 +1,71 @@
 # standard
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+import atexit
 import csv
+import io
+import functools
+import heapq
+import json
+import keyword
+import math
+import operator
+import os
+import pickle
+from itertools import chain, islice
+import shutil
+import subprocess
 import sys
 import tempfile
+import threading
+import time
 import unittest
+# optional
+def _json_dumps(x): # the reference encoding: compact, unescaped unicode, NaN as in Python
+    return json.dumps(x, separators=(',', ':'), ensure_ascii=False)
+try: # accelerated json codecs, if installed, deferring to json for whatever they encode differently
+    import orjson
+    def json_loads(s):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError: # e.g. NaN
+            return json.loads(s)
+    def _finite(x): # holds no NaN or infinite floats (which orjson writes as null)?
+        if type(x) is float:
+            return math.isfinite(x)
+        elif isinstance(x, dict):
+            x = x.values()
+        elif not isinstance(x, (list, tuple)):
+            return True
+        for value in x:
+            if type(value) is float:
+                if not math.isfinite(value):
+                    return False
+            elif isinstance(value, (dict, list, tuple)) and not _finite(value):
+                return False
+        return True
+    def json_dumps(x):
+        if not _finite(x):
+            return _json_dumps(x)
+        try:
+            return orjson.dumps(x, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except TypeError: # e.g. integers beyond 64 bits
+            return _json_dumps(x)
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+        def json_dumps(x):
+            try:
+                return ujson.dumps(x, ensure_ascii=False, escape_forward_slashes=False)
+            except (TypeError, ValueError, OverflowError): # e.g. integers beyond 64 bits
+                return _json_dumps(x)
+    except ImportError:
+        json_loads, json_dumps = json.loads, _json_dumps
+# internal
+from nits.cache import Cache
+from nits.cast import infer as infer_cast, Nones, To # (infer is also an option of CSV.read)
 
 class File:
     '''
@@ -26,6 +88,94 @@ class File:
         '''
         assert False
 
+    @staticmethod
+    @contextmanager
+    def output(filename, append=False, atomic=False, newline=None):
+        '''
+        open a file for writing text (standard output if filename is None)
+
+        - append: add to existing file?
+        - atomic: write to a temporary file in the same folder,
+          renamed over filename once complete (ignored when appending)
+        '''
+        if filename is None:
+            yield sys.stdout
+        elif atomic and not append:
+            folder, name = os.path.split(os.path.abspath(filename))
+            descriptor, temporary = tempfile.mkstemp(dir=folder, prefix='.' + name, suffix='.tmp')
+            try:
+                if os.path.exists(filename):
+                    shutil.copymode(filename, temporary)
+                else:
+                    mask = os.umask(0)
+                    os.umask(mask)
+                    os.chmod(temporary, 0o666 & ~mask)
+                with os.fdopen(descriptor, 'w', newline=newline) as f:
+                    yield f
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporary, filename)
+            except BaseException:
+                os.remove(temporary)
+                raise
+        else:
+            with open(filename, 'a' if append else 'w', newline=newline) as f:
+                yield f
+
+    @classmethod
+    def map(cls,
+        filename,
+        fn,
+        workers=None,
+        chunk_lines=1000,
+        ordered=True,
+        reduce=None,
+        **options):
+        '''
+        apply fn to every record of a file in a pool of worker processes
+
+        - fn: a picklable (e.g. module level) function of one record
+        - workers: number of processes (default: one per CPU)
+        - chunk_lines: how many records to send to a worker at a time
+        - ordered: return results in file order? (otherwise in order of completion)
+        - reduce: optional picklable, associative function of two results;
+          if given, return the results combined (per chunk in the workers, then overall)
+        - options: passed on to read (e.g. comment, blanklines, header)
+        '''
+        results = cls._map(filename, fn, workers or os.cpu_count() or 1, chunk_lines,
+            ordered, reduce, options)
+        if reduce is None:
+            return (result for chunk in results for result in chunk)
+        for first in results:
+            return functools.reduce(reduce, results, first)
+        return None # no records
+
+    @classmethod
+    def _map(cls, filename, fn, workers, chunk_lines, ordered, reduce, options):
+        records = iter(cls.read(filename, **options))
+        chunks = iter(lambda: list(islice(records, chunk_lines)), [])
+        def completed(pending):
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending -= done
+                for future in done:
+                    yield future.result()
+
+        with ProcessPoolExecutor(workers) as pool:
+            pending = deque() if ordered else set()
+            for chunk in chunks:
+                future = pool.submit(_apply, fn, reduce, chunk)
+                if ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+                if len(pending) >= 2 * workers: # bound the records in flight
+                    yield from completed(pending)
+            while pending:
+                yield from completed(pending)
+
     @staticmethod
     def decomment(file, comment):
         for row in file:
@@ -36,6 +186,13 @@ class File:
                 if raw:
                     yield raw
 
+def _apply(fn, reduce, chunk):
+    '''
+    apply fn (and perhaps reduce) to a chunk of records within a worker process
+    '''
+    results = [fn(record) for record in chunk]
+    return results if reduce is None else functools.reduce(reduce, results)
+
 class Text(File):
     '''
     Instantiate the File class for a simple text file
@@ -72,44 +229,417 @@ class Text(File):
     def write(cls,
         data,
         filename,
-        eol='\n' # explicitly change the End of Line marker
+        eol='\n', # explicitly change the End of Line marker
+        atomic=False # replace filename only once completely written
         ):
-        if filename is None:
-            f = sys.stdout
-        else:
-            f = open(filename, 'wt')
-        with f:
+        with File.output(filename, atomic=atomic) as f:
             for datum in data:
                 f.write(datum + eol)
 
+    @classmethod
+    def appender(cls, filename, eol='\n', **options):
+        '''
+        return an Appender of lines to filename; options are passed to Appender
+        '''
+        return Appender(filename, lambda datum: datum + eol, **options)
+
+class Appender:
+    '''
+    A long lived appender to a file, coalescing many small writes into large ones:
+    the buffer is written once it holds `size` characters or is `interval` seconds old
+    (by a timer thread), on flush, on close and at exit.
+    '''
+
+    def __init__(self,
+        filename,
+        formatter=str,
+        size=2**16,
+        interval=1.0,
+        fsync=False,
+        newline=None):
+        '''
+        - formatter: turn a datum into the text appended
+        - size: buffered characters triggering a write
+        - interval: seconds after which buffered text is written (None: only once size is reached)
+        - fsync: commit each write to disk (a group commit of the buffered data)
+        '''
+        self.formatter, self.size, self.interval, self.fsync = formatter, size, interval, fsync
+        self.file = open(filename, 'a', newline=newline)
+        self.buffer, self.buffered = [], 0
+        self.lock, self.timer = threading.RLock(), None
+        atexit.register(self.close)
+
+    def write(self, text):
+        '''
+        append raw text
+        '''
+        with self.lock:
+            if not self.buffer and self.interval is not None: # write it out in interval seconds
+                self.timer = threading.Timer(self.interval, self._expire)
+                self.timer.daemon = True
+                self.timer.start()
+            self.buffer.append(text)
+            self.buffered += len(text)
+            if self.buffered >= self.size:
+                self.flush()
+
+    def _expire(self):
+        with self.lock:
+            self.timer = None
+            if not self.file.closed:
+                self.flush()
+
+    def append(self, datum):
+        '''
+        append a formatted datum
+        '''
+        self.write(self.formatter(datum))
+
+    def extend(self, data):
+        '''
+        append formatted data
+        '''
+        for datum in data:
+            self.write(self.formatter(datum))
+
+    def flush(self):
+        '''
+        write (and perhaps commit) the buffer
+        '''
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.buffer:
+                self.file.write(''.join(self.buffer))
+                self.buffer, self.buffered = [], 0
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.flush()
+                self.file.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+FAST_SAMPLE = 1000 # lines checked for quotes before reading CSV the fast way
+
+class Schema(OrderedDict):
+    '''
+    An ordered mapping of field to cast, applied by position to each record.
+    Usually inferred from a sample of records, then pinned and reused.
+    '''
+    @classmethod
+    def infer(cls, records, fields=None):
+        '''
+        infer the cast of each column from a sample of records (lists of strings);
+        without fields, columns are keyed by position
+        '''
+        records = list(records)
+        width = max([len(record) for record in records] + [0 if fields is None else len(fields)])
+        if fields is None:
+            fields = list(range(width))
+        return cls((field, infer_cast([r[i] for r in records if i < len(r)]))
+            for i, field in enumerate(fields))
+
+    def compile(self):
+        '''
+        return a function casting a record (list of strings) into a list of values,
+        raising ValueError (naming the field) for a value which does not fit its cast
+        '''
+        fields, casts = tuple(self.keys()), tuple(self.values())
+        def converter(record):
+            try:
+                return [f(x) for f, x in zip(casts, record)]
+            except (ValueError, TypeError):
+                for field, f, x in zip(fields, casts, record):
+                    try:
+                        f(x)
+                    except (ValueError, TypeError) as error:
+                        raise ValueError('field ' + repr(field) + ': ' + repr(x) + ' does not fit '
+                            + getattr(f, '__qualname__', repr(f))
+                            + ' (sample more records or pin a wider Schema)') from error
+                raise
+        return converter
+
+    def key(self):
+        '''
+        a repr-able key identifying the casts by their importable names (to key cached reads),
+        or None if any cast (e.g. a lambda or closure) cannot be identified by its name
+        '''
+        names = [_name(f) for f in self.values()]
+        return None if None in names else tuple(zip(self.keys(), names))
+
+    def __repr__(self):
+        return 'Schema(' + ', '.join(str(field) + ':' + getattr(f, '__qualname__', repr(f))
+            for field, f in self.items()) + ')'
+
+def _name(f):
+    '''
+    the importable name (module.qualname) of a function, or None if that name does not reach it
+    '''
+    target = sys.modules.get(getattr(f, '__module__', None))
+    qualname = getattr(f, '__qualname__', None)
+    if target is None or qualname is None:
+        return None
+    for part in qualname.split('.'):
+        target = getattr(target, part, None)
+    return f.__module__ + '.' + qualname if target is f else None
+
+class Record:
+    '''
+    Mixin of compact records generated per header by record_class,
+    with key (and, for identifier fields, attribute) access
+    '''
+    __slots__ = ()
+    fields, kind, _index = (), None, {}
+
+    def __getitem__(self, key):
+        return self._values()[self._index[key] if isinstance(key, str) else key]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self.fields)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._index else default
+
+    def keys(self):
+        return list(self.fields)
+
+    def values(self):
+        return list(self._values())
+
+    def items(self):
+        return list(zip(self.fields, self._values()))
+
+    def to_dict(self):
+        return OrderedDict(zip(self.fields, self._values()))
+
+    def __reduce__(self):
+        return _record, (self.kind, self.fields, self.values())
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + ', '.join(
+            str(field) + '=' + repr(value) for field, value in self.items()) + ')'
+
+class _SlotsRecord(Record):
+    __slots__ = ()
+
+    def _values(self):
+        return tuple([getattr(self, slot) for slot in self.__slots__])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._values()[key]
+        return getattr(self, self.__slots__[self._index[key] if isinstance(key, str) else key])
+
+    def __iter__(self):
+        return iter(self._values())
+
+    def __eq__(self, other):
+        return isinstance(other, _SlotsRecord) and \
+            (self.fields, self._values()) == (other.fields, other._values())
+
+    __hash__ = None
+
+class _TupleRecord(Record, tuple):
+    __slots__ = ()
+
+    def __new__(cls, values):
+        if len(values) != len(cls.fields):
+            values = (list(values) + [None] * len(cls.fields))[:len(cls.fields)]
+        return tuple.__new__(cls, values)
+
+    def _values(self):
+        return tuple(self)
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, self._index[key] if isinstance(key, str) else key)
+
+    def __contains__(self, key): # as a record rather than a tuple
+        return key in self._index
+
+@functools.lru_cache(maxsize=None)
+def record_class(fields, kind='slots'):
+    '''
+    return the record class (generated once) for a tuple of fields, where kind is either:
+
+    - slots: a class with __slots__
+    - tuple: a tuple subclass
+
+    Records are built from a list of values, support record[field] (and record.field
+    for fields which are identifiers), iterate over their values and convert with to_dict()
+    '''
+    def attribute(i, field):
+        if isinstance(field, str) and field.isidentifier() and not keyword.iskeyword(field) \
+            and not field.startswith('_') and not hasattr(_TupleRecord, field):
+            return field
+        return '_' + str(i)
+    names = [attribute(i, field) for i, field in enumerate(fields)]
+    if len(set(names)) < len(names): # repeated fields are reached by position only
+        names = ['_' + str(i) for i in range(len(fields))]
+    namespace = {
+        'fields': fields,
+        'kind': kind,
+        '_index': dict((field, i) for i, field in reversed(list(enumerate(fields))))}
+    if kind == 'slots':
+        namespace['__slots__'] = tuple(names)
+        assigned = ', '.join('self.' + name for name in names) + (',' if names else '')
+        code = (
+            'def __init__(self, values):\n'
+            '    try:\n'
+            '        ' + assigned + ' = values\n'
+            '    except ValueError:\n'
+            '        ' + assigned + ' = (list(values) + [None] * n)[:n]\n')
+        local = {}
+        exec(code, {'n': len(names)}, local) # names are checked identifiers
+        namespace['__init__'] = local['__init__']
+        return type('SlotsRecord', (_SlotsRecord,), namespace)
+    elif kind == 'tuple':
+        for i, name in enumerate(names):
+            if not name.startswith('_'):
+                namespace[name] = property(operator.itemgetter(i))
+        return type('TupleRecord', (_TupleRecord,), namespace)
+    else:
+        assert False, 'unknown kind of record: ' + str(kind)
+
+def _record(kind, fields, values):
+    return record_class(fields, kind)(values)
+
 class CSV(File):
     '''
     Instantiate the File class for Comma Separated Values (CSV)
     '''
+    @classmethod
+    def records(cls, filename, comment=None, delimiter=',', fast=None):
+        '''
+        return every non-empty record (header included) as a list of stripped strings
+
+        - delimiter: what character separates elements
+        - fast: split lines on the delimiter rather than parse them with the csv module,
+          except for lines with quotes; by default, only if the first lines have no quotes
+        '''
+        with open(filename, 'rt') as file:
+            lines = file if comment is None else File.decomment(file, comment)
+            if fast is None:
+                sampled = list(islice(lines, FAST_SAMPLE))
+                fast = not any(['"' in line for line in sampled])
+                lines = chain(sampled, lines)
+            if not fast:
+                for record in csv.reader(lines, delimiter=delimiter):
+                    if len(record) == 0:
+                        continue
+                    yield [f.strip() for f in record]
+                return
+            for line in lines:
+                if '"' in line: # quoted (perhaps over several lines)
+                    yield [f.strip() for f in next(csv.reader(chain([line], lines), delimiter=delimiter))]
+                    continue
+                if line.endswith('\n'):
+                    line = line[:-1]
+                if not line:
+                    continue
+                elif ' ' in line or not line.isprintable(): # whitespace to strip
+                    yield list(map(str.strip, line.split(delimiter)))
+                else:
+                    yield line.split(delimiter)
+
+    @classmethod
+    def infer(cls,
+        filename,
+        header=True,
+        comment=None,
+        fields=None,
+        sample=100,
+        delimiter=','):
+        '''
+        infer a Schema from the first `sample` records of a file
+        '''
+        records = cls.records(filename, comment, delimiter)
+        if header:
+            first = next(records, None)
+            if fields is None:
+                fields = first
+        return Schema.infer(islice(records, sample), fields)
+
+    @classmethod
+    def parse(cls,
+        filename,
+        header=True,
+        comment=None,
+        fields=None,
+        infer=False,
+        schema=None,
+        sample=100,
+        delimiter=',',
+        fast=None):
+        '''
+        return the fields (None without a header) and a generator of (cast) records as lists
+        '''
+        records = cls.records(filename, comment, delimiter, fast)
+        if header:
+            first = next(records, None)
+            if fields is None:
+                fields = first
+        if infer and schema is None:
+            sampled = list(islice(records, sample))
+            schema = Schema.infer(sampled, fields if header else None)
+            records = chain(sampled, records)
+        if schema is not None:
+            records = map(schema.compile(), records)
+        return (fields if header else None), records
+
     @classmethod
     def read(cls,
         filename,
         header=True,
         comment=None,
-        fields=None):
+        fields=None,
+        infer=False,
+        schema=None,
+        sample=100,
+        cache=None,
+        record='dict',
+        delimiter=',',
+        fast=None):
         '''
         - header: is first line the header?
         - fields: optional list of field values
+        - infer: cast columns with a Schema inferred from the first `sample` records
+        - schema: optional (pinned) Schema used to cast each record
+        - cache: optional nits.cache.Cache of parsed records, skipping the parse on later reads
+          (not used with a schema whose casts cannot be identified by name, see Schema.key)
+        - record: with a header, yield each record as an OrderedDict ('dict')
+          or as a compact 'slots' or 'tuple' record (see record_class)
+        - delimiter: what character separates elements
+        - fast: split unquoted lines on the delimiter (see records; by default, if no quotes are sampled)
         '''
-        with open(filename, 'rt') as file:
-            csv_file = csv.reader(File.decomment(file, comment))
-            for i, record in enumerate(csv_file):
-                if len(record) == 0:
-                    continue
-                record = [f.strip() for f in record]
-                if header:
-                    if i == 0:
-                        if fields is None:
-                            fields = record
-                    else:
-                        yield OrderedDict(list(zip(fields, record)))
-                else:
-                    yield record
+        key = None if schema is None else schema.key()
+        options = (header, comment, fields, infer, key, sample)
+        def parse():
+            return cls.parse(filename, header, comment, fields, infer, schema, sample, delimiter, fast)
+        if cache is None or (schema is not None and key is None):
+            fields, records = parse()
+        else:
+            fields, records = cache.fetch(filename, ('CSV',) + options + (delimiter,), parse)
+        if not header:
+            yield from records
+        elif record == 'dict':
+            for values in records:
+                yield OrderedDict(zip(fields, values))
+        else:
+            yield from map(record_class(tuple(fields), record), records)
 
     @classmethod
     def write(cls,
@@ -118,12 +648,14 @@ class CSV(File):
         fields=None,
         header=True,
         append=False,
-        delimiter=','):
+        delimiter=',',
+        atomic=False):
         '''
         - fields: optional list of field values
         - header: display header on first line?
         - append: add to existing file?
         - delimiter: what character to use for separating elements
+        - atomic: replace filename only once completely written
         '''
 
         def formatter(datum, fields):
@@ -135,22 +667,11 @@ class CSV(File):
                     if field in datum:
                         d[field] = datum[field]
                 return d
-        if append:
-            mode = 'a'
-        else:
-            mode = 'w'
-
-        if filename is None:
-            f = sys.stdout
-        elif sys.version_info < (3, 0, 0):
-            mode += 'b'
-            f = open(filename, mode)
-        else:
-            f = open(filename, mode, newline='')
-
-        with f as csv_file:
+        with File.output(filename, append, atomic, newline='') as csv_file:
             first = True
             for datum in data:
+                if isinstance(datum, Record):
+                    datum = datum.to_dict()
                 if first:
                     if fields is None:
                         if isinstance(datum, dict):
@@ -164,6 +685,301 @@ class CSV(File):
                     first = False
                 csv_writer.writerow(formatter(datum, fields))
 
+    @classmethod
+    def appender(cls,
+        filename,
+        fields=None,
+        header=True,
+        delimiter=',',
+        **options):
+        '''
+        return an Appender of records (dictionaries or lists) to filename
+
+        - fields: list of field values (required for dictionaries)
+        - header: write fields on the first line of a new (or empty) file?
+        - delimiter: what character to use for separating elements
+        - options: passed to Appender
+        '''
+        line = io.StringIO()
+        writer = csv.writer(line, lineterminator='\n', delimiter=delimiter)
+
+        def formatter(datum):
+            if isinstance(datum, dict):
+                datum = [datum.get(field, '') for field in fields]
+            line.seek(0)
+            line.truncate()
+            writer.writerow(datum)
+            return line.getvalue()
+
+        appender = Appender(filename, formatter, newline='', **options)
+        if header and fields is not None and appender.file.tell() == 0:
+            appender.append(fields)
+        return appender
+
+    @classmethod
+    def sort(cls,
+        src,
+        dst,
+        key=None,
+        casts=None,
+        unique=False,
+        memory_limit=2**27,
+        workers=None,
+        comment=None,
+        folder=None,
+        fan_in=64):
+        '''
+        sort a (header) CSV file of any size through sorted runs in temporary files
+
+        - key: field name or list of field names to sort on (default: all fields)
+        - casts: optional dictionary of field to (picklable) cast, e.g. {'size': To.integer}
+        - unique: keep only the first record of each key
+        - memory_limit: approximate size (in bytes) of the records held in a run
+        - workers: sort runs in this many processes (each holding a run)
+        - folder: where to put the temporary runs
+        - fan_in: most runs merged (and files open) at once; more are merged in passes
+        '''
+        fields, records = cls.parse(src, comment=comment)
+        if fields is None:
+            return
+        key = _Key(fields, key, casts)
+        columns = list(range(len(fields)))
+        with tempfile.TemporaryDirectory(dir=folder) as temporary:
+            runs, pending = [], deque()
+            pool = ProcessPoolExecutor(workers) if workers else None
+            try:
+                for run in _runs(records, memory_limit):
+                    filename = os.path.join(temporary, str(len(runs)) + '.csv')
+                    runs.append(filename)
+                    if pool is None:
+                        _sort_run(run, filename, columns, key, unique)
+                    else:
+                        pending.append(pool.submit(_sort_run, run, filename, columns, key, unique))
+                        while len(pending) >= workers: # bound the runs held in memory
+                            pending.popleft().result()
+                for future in pending:
+                    future.result()
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+            def merge(runs):
+                merged = heapq.merge(*[cls.read(run, header=False) for run in runs], key=key)
+                return _unique(merged, key) if unique else merged
+            count = len(runs)
+            while len(runs) > fan_in: # merge groups of runs into longer runs (keeping their order)
+                merged_runs = []
+                for i in range(0, len(runs), fan_in):
+                    filename = os.path.join(temporary, str(count) + '.csv')
+                    count += 1
+                    cls.write(merge(runs[i:i + fan_in]), filename, fields=columns, header=False)
+                    for run in runs[i:i + fan_in]:
+                        os.remove(run)
+                    merged_runs.append(filename)
+                runs = merged_runs
+            cls.write(merge(runs), dst, fields=fields)
+
+    @classmethod
+    def unique(cls, src, dst, key=None, **options):
+        '''
+        sort a (header) CSV file keeping only the first record of each key; see sort
+        '''
+        cls.sort(src, dst, key=key, unique=True, **options)
+
+    @classmethod
+    def join(cls,
+        left,
+        right,
+        on,
+        how='inner',
+        strategy='hash',
+        casts=None,
+        fields=None,
+        comment=None,
+        suffix='_right'):
+        '''
+        generate the records of two (header) CSV files joined on common fields:
+        the left fields followed by the right fields not joined on
+
+        - on: field name or list of field names found in both files
+        - how: 'inner' or 'left' (also keep left records without a match, with None for right fields)
+        - strategy: 'hash' holds the smaller file in memory (records are generated in
+          the order of the larger one); 'merge' streams files already sorted on `on`
+        - casts: optional dictionary of field to cast used to compare (and order) keys
+        - fields: optional list of the fields to keep in each joined record
+        - suffix: added to the names of right fields (not joined on) which are also left fields
+        '''
+        assert how in ('inner', 'left') and strategy in ('hash', 'merge')
+        left_fields, left_records = cls.parse(left, comment=comment)
+        right_fields, right_records = cls.parse(right, comment=comment)
+        if left_fields is None or right_fields is None:
+            return
+        left_key, right_key = _Key(left_fields, on, casts), _Key(right_fields, on, casts)
+        joined = set(right_fields[i] for i in right_key.columns)
+        rest = [i for i, field in enumerate(right_fields) if field not in joined]
+        missing = [None] * len(rest)
+
+        def project(record): # the right values kept in the joined record
+            return [record[i] for i in rest]
+
+        names = list(left_fields)
+        for i in rest:
+            name = right_fields[i]
+            while name in names:
+                name += suffix
+            names.append(name)
+        keep = None if fields is None else [names.index(field) for field in fields]
+        if keep is not None:
+            names = list(fields)
+
+        def pairs():
+            if strategy == 'merge':
+                for l, r in cls._merge_join(left_records, right_records, left_key, right_key, how):
+                    yield l, missing if r is None else project(r)
+            elif os.path.getsize(right) <= os.path.getsize(left):
+                table = defaultdict(list)
+                for record in right_records: # compactly: only the values kept
+                    table[right_key(record)].append(tuple(project(record)))
+                for record in left_records:
+                    matches = table.get(left_key(record))
+                    if matches:
+                        for match in matches:
+                            yield record, list(match)
+                    elif how == 'left':
+                        yield record, missing
+            else: # build from the (smaller) left file
+                table, order, matched = defaultdict(list), [], set()
+                for record in left_records:
+                    k = left_key(record)
+                    table[k].append(record)
+                    if how == 'left':
+                        order.append(k)
+                for record in right_records:
+                    k = right_key(record)
+                    if k in table:
+                        matched.add(k)
+                        for match in table[k]:
+                            yield match, project(record)
+                for k in order: # unmatched left records, in file order
+                    if k not in matched:
+                        yield table[k].pop(0), missing
+
+        for l, r in pairs():
+            values = l + r
+            if keep is not None:
+                values = [values[i] for i in keep]
+            yield OrderedDict(zip(names, values))
+
+    @staticmethod
+    def _merge_join(left_records, right_records, left_key, right_key, how):
+        right_records = iter(right_records)
+        r = next(right_records, None)
+        group_key, group = object(), []
+        for l in left_records:
+            k = left_key(l)
+            if k != group_key:
+                group_key, group = k, []
+                while r is not None and right_key(r) < k:
+                    r = next(right_records, None)
+                while r is not None and right_key(r) == k:
+                    group.append(r)
+                    r = next(right_records, None)
+            if group:
+                for match in group:
+                    yield l, match
+            elif how == 'left':
+                yield l, None
+
+class _Key:
+    '''
+    picklable sort key of records (lists): the (cast) values of some fields
+    '''
+    def __init__(self, fields, key=None, casts=None):
+        if key is None:
+            key = fields
+        elif isinstance(key, str):
+            key = [key]
+        casts = casts or {}
+        self.columns = [fields.index(field) for field in key]
+        self.casts = [casts.get(field, To.identity) for field in key]
+
+    def __call__(self, record):
+        return tuple([f(record[i]) for f, i in zip(self.casts, self.columns)])
+
+def _runs(records, memory_limit):
+    '''
+    split records into lists holding about memory_limit bytes
+    '''
+    run, size = [], 0
+    for record in records:
+        run.append(record)
+        size += sys.getsizeof(record) + sum(map(sys.getsizeof, record))
+        if size >= memory_limit:
+            yield run
+            run, size = [], 0
+    if run:
+        yield run
+
+def _unique(records, key):
+    '''
+    drop records with the same key as their (sorted) predecessor
+    '''
+    last = object()
+    for record in records:
+        k = key(record)
+        if k != last:
+            last = k
+            yield record
+
+def _sort_run(run, filename, columns, key, unique):
+    run.sort(key=key)
+    CSV.write(_unique(run, key) if unique else run, filename, fields=columns, header=False)
+
+class JSONL(File):
+    '''
+    Instantiate the File class for JSON lines: one JSON record per line
+    (orjson or ujson are used when installed, writing the same values as json would,
+    though floats may be written differently, e.g. 1e16 rather than 1e+16)
+    '''
+    @classmethod
+    def read(cls,
+        filename,
+        comment=None,
+        fields=None):
+        '''
+        - comment: ignore lines starting with this marker
+          (trailing comments are not supported since they may be part of a JSON string)
+        - fields: optional list of fields to keep from each object record (missing ones are None);
+          other records (e.g. arrays) are kept as they are
+        '''
+        with open(filename, 'rt') as f:
+            for line in f:
+                if comment is not None and line.lstrip().startswith(comment):
+                    continue
+                if not line.strip():
+                    continue
+                record = json_loads(line)
+                if fields is None or not isinstance(record, dict):
+                    yield record
+                else:
+                    yield OrderedDict((field, record.get(field)) for field in fields)
+
+    @classmethod
+    def write(cls,
+        data,
+        filename=None,
+        append=False,
+        batch=1000,
+        atomic=False):
+        '''
+        - append: add to existing file?
+        - batch: how many records to encode per write
+        - atomic: replace filename only once completely written
+        '''
+        data = iter(data)
+        with File.output(filename, append, atomic) as f:
+            for chunk in iter(lambda: list(islice(data, batch)), []):
+                f.write(''.join([json_dumps(datum) + '\n' for datum in chunk]))
+
 class Test_File(unittest.TestCase):
 
     def setUp(self):
@@ -186,5 +1002,160 @@ class Test_File(unittest.TestCase):
             assert list(same.keys()) == self.data[0]
             assert list(same.values()) == self.data[i+1]
 
+    def test_map(self):
+        data = [' '.join(datum) for datum in self.data] * 50
+        Text.write(data, self.filename)
+        for ordered in [True, False]:
+            results = list(Text.map(self.filename, str.upper, workers=2, chunk_lines=7, ordered=ordered))
+            assert sorted(results) == sorted(x.upper() for x in data)
+            if ordered:
+                assert results == [x.upper() for x in data]
+        assert CSV.map(self.filename, len, workers=2, chunk_lines=7, reduce=operator.add,
+            header=False) == len(data)
+
+    def test_sort(self):
+        data = [['a', 'b']] + [[str(i % 7), str(i)] for i in range(100)]
+        CSV.write(data, self.filename, header=False)
+        with tempfile.NamedTemporaryFile() as sorted_file:
+            for workers, fan_in in [(None, 64), (2, 2), (None, 3)]: # (several merge passes)
+                CSV.sort(self.filename, sorted_file.name, key=['a', 'b'], casts={'b': To.integer},
+                    memory_limit=1000, workers=workers, fan_in=fan_in)
+                records = [list(r.values()) for r in CSV.read(sorted_file.name)]
+                assert records == sorted(data[1:], key=lambda r: (r[0], int(r[1])))
+            CSV.unique(self.filename, sorted_file.name, key='a', memory_limit=1000, fan_in=2)
+            records = [list(r.values()) for r in CSV.read(sorted_file.name)]
+            assert records == [[str(i), str(i)] for i in range(7)]
+
+    def test_join(self):
+        CSV.write([['k', 'x']] + [[str(i), 'x' + str(i)] for i in range(6)], self.filename, header=False)
+        with tempfile.NamedTemporaryFile() as right:
+            CSV.write([['y', 'k']] + [['y' + str(i), str(i)] for i in [1, 3, 3, 5, 9]], right.name, header=False)
+            for strategy in ['hash', 'merge']:
+                inner = list(CSV.join(self.filename, right.name, 'k', strategy=strategy))
+                assert [list(r.values()) for r in inner] == \
+                    [['1', 'x1', 'y1'], ['3', 'x3', 'y3'], ['3', 'x3', 'y3'], ['5', 'x5', 'y5']]
+                outer = list(CSV.join(self.filename, right.name, 'k', how='left', strategy=strategy,
+                    fields=['y', 'k']))
+                assert len(outer) == 7 and outer[0] == OrderedDict([('y', None), ('k', '0')])
+            swapped = list(CSV.join(right.name, self.filename, 'k', how='left'))
+            assert [r['x'] for r in swapped] == ['x1', 'x3', 'x3', 'x5', None]
+            CSV.write([['k', 'x'], ['3', 'right']], right.name, header=False)
+            for strategy in ['hash', 'merge']: # the same field on both sides
+                assert list(CSV.join(self.filename, right.name, 'k', strategy=strategy)) == \
+                    [OrderedDict([('k', '3'), ('x', 'x3'), ('x_right', 'right')])]
+
+    def test_appender(self):
+        with Text.appender(self.filename, size=10, interval=None) as appender:
+            appender.extend(['a', 'b'])
+            assert os.path.getsize(self.filename) == 0
+            appender.append('c' * 10)
+            assert list(Text.read(self.filename)) == ['a', 'b', 'c' * 10]
+        fields = self.data[0]
+        for _ in range(2):
+            with CSV.appender(self.filename + '.csv', fields, fsync=True) as appender:
+                appender.append(self.data[1])
+                appender.append(OrderedDict(zip(fields, self.data[2])))
+        records = [list(r.values()) for r in CSV.read(self.filename + '.csv')]
+        os.remove(self.filename + '.csv')
+        assert records == self.data[1:3] * 2
+        appender = Text.appender(self.filename, interval=.01)
+        appender.append('idle')
+        time.sleep(.2)
+        assert list(Text.read(self.filename)) == ['a', 'b', 'c' * 10, 'idle']
+        appender.close()
+        script = 'from nits.file import Text; Text.appender(' + repr(self.filename) + ').append("exit")'
+        subprocess.check_call([sys.executable, '-c', script], cwd=os.path.dirname(os.path.dirname(__file__)))
+        assert list(Text.read(self.filename))[-1] == 'exit'
+
+    def test_atomic(self):
+        Text.write(['old'], self.filename)
+        with self.assertRaises(TypeError):
+            Text.write(['new', None], self.filename, atomic=True)
+        assert list(Text.read(self.filename)) == ['old']
+        CSV.write(self.data, self.filename, header=False, atomic=True)
+        assert len(list(CSV.read(self.filename))) == len(self.data) - 1
+
+    def test_records(self):
+        CSV.write([['a', 'b c', 'd', 'keys']] + self.data[1:], self.filename, header=False)
+        dicts = list(CSV.read(self.filename))
+        for kind in ['slots', 'tuple']:
+            records = list(CSV.read(self.filename, record=kind))
+            assert [r.to_dict() for r in records] == dicts
+            first = records[0]
+            assert first.a == first['a'] == first[0] == 'a0' and first['b c'] == 'a1'
+            assert first['keys'] == first[-1] == 'a3' and first.keys() == ['a', 'b c', 'd', 'keys']
+            assert first[1:3] == ('a1', 'a2')
+            assert list(first) == self.data[1] and 'd' in first and type(first) is type(records[1])
+            assert pickle.loads(pickle.dumps(first)) == first
+            short = record_class(('x', 'y'), kind)(['1'])
+            assert short.x == '1' and short['y'] is None
+        CSV.write(records, self.filename)
+        assert list(CSV.read(self.filename)) == dicts
+
+    def test_fast(self):
+        lines = ['a, b ,c', '1,2,3', '', ' ', '"x, y",2,"multi', 'line"', '4,5', '# comment', '6;7,8 # x']
+        Text.write(lines, self.filename)
+        for comment in [None, '#']:
+            expected = list(CSV.read(self.filename, comment=comment, fast=False))
+            for fast in [None, True]:
+                assert list(CSV.read(self.filename, comment=comment, fast=fast)) == expected
+        assert expected[-1] == OrderedDict([('a', '6;7'), ('b', '8')])
+        CSV.write(self.data, self.filename, header=False, delimiter=';')
+        for fast in [None, False]:
+            assert [list(r.values()) for r in CSV.read(self.filename, delimiter=';', fast=fast)] == \
+                self.data[1:]
+
+    def test_jsonl(self):
+        data = [OrderedDict([('a', i), ('b', 'x' * i), ('c', None)]) for i in range(5)]
+        JSONL.write(data[:2], self.filename, batch=1)
+        JSONL.write(data[2:], self.filename, append=True)
+        assert list(JSONL.read(self.filename)) == data
+        with open(self.filename, 'a') as f:
+            f.write('\n  # comment\n')
+        assert list(JSONL.read(self.filename, comment='#', fields=['c', 'a'])) == \
+            [OrderedDict([('c', None), ('a', i)]) for i in range(5)]
+        odd = [{1: 'a'}, {'big': 2**70}, [float('nan'), 'é/'], [None]] # the same with any codec
+        JSONL.write(odd, self.filename)
+        with open(self.filename) as f:
+            assert f.read() == '{"1":"a"}\n{"big":1180591620717411303424}\n[NaN,"é/"]\n[null]\n'
+        assert list(JSONL.read(self.filename, fields=['big']))[1:] == \
+            [OrderedDict([('big', 2**70)])] + list(JSONL.read(self.filename))[2:]
+
+    def test_infer(self):
+        data = [['i', 'x', 'n', 's'], [1, 1.5, '', 'a'], [2, 3, 4, 'b']]
+        CSV.write(data, self.filename, header=False)
+        schema = CSV.infer(self.filename)
+        assert list(schema.values()) == [int, float, Nones.exact_integer, To.string]
+        for pinned in [None, schema]:
+            records = list(CSV.read(self.filename, infer=True, schema=pinned))
+            assert records[0] == OrderedDict([('i', 1), ('x', 1.5), ('n', None), ('s', 'a')])
+            assert records[1]['n'] == 4
+        CSV.write([['i'], ['12345678901234567891'], [-2**70]], self.filename, header=False)
+        assert [r['i'] for r in CSV.read(self.filename, infer=True)] == [12345678901234567891, -2**70]
+        for bad in ['', '2.5', 'n/a']: # after the sample
+            CSV.write([['i'], [1], [2], [bad]], self.filename, header=False)
+            with self.assertRaisesRegex(ValueError, "field 'i'"):
+                list(CSV.read(self.filename, infer=True, sample=2))
+
+    def test_cache(self):
+        CSV.write(self.data, self.filename, header=False)
+        with tempfile.TemporaryDirectory() as folder:
+            cache = Cache(folder)
+            for header in [True, False, True]:
+                assert list(CSV.read(self.filename, header=header, cache=cache)) == \
+                    list(CSV.read(self.filename, header=header))
+            assert len(os.listdir(folder)) == 2
+            assert Schema(a=Nones.integer, b=int).key() == (('a', 'nits.cast.Nones.integer'), ('b', 'builtins.int'))
+            for f in [lambda x: 'one', lambda x: 'two']: # same __qualname__, so not cached
+                schema = Schema((field, f) for field in self.data[0])
+                assert schema.key() is None
+                assert next(CSV.read(self.filename, schema=schema, cache=cache))['x0'] == f('')
+            assert len(os.listdir(folder)) == 2
+            CSV.write([['i', 'x'], ['12345678901234567891', '1.5'], ['-3', '2']], self.filename, header=False)
+            for _ in range(2): # parsed, then from the sidecar
+                records = [list(r.values()) for r in CSV.read(self.filename, infer=True, cache=cache)]
+                assert records == [[12345678901234567891, 1.5], [-3, 2.]]
+                assert [type(x) for x in records[1]] == [int, float]
+
 if __name__ == '__main__':
     unittest.main()
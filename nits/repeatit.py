@@ -4,17 +4,26 @@ Description:
     Run the same command on a bunch of files
 
 Usage:
-    repeatit -c <command> <files>... [-d]
+    repeatit -c <command> <files>... [-d] [-i] [-s <state>] [-o <output>] [-n <count>] [-j <jobs>]
 
 Text replacement options within (-c) command string:
     - %f gets replaced with the file name
     - %n gets replaced with the file name up to the last extension
+    - %F gets replaced with a batch of (quoted) file names, as many as the system allows
+      (a batch size also batches, adding the file names to the end of a command without %F,
+      which must then not use %f or %n)
 
 Options:
     -h --help                show this screen
     -c, --command <command>  command
     -f, --files <files>      file list
     -d, --dontwait           do not wait for them to complete
+    -i, --incremental        skip files unchanged (as is the command) since their last successful run
+    -s, --state <state>      where incremental runs are recorded [default: .repeatit.jsonl]
+    -o, --output <output>    output pattern (e.g. %n.out): incremental runs also redo files
+                             whose output is missing or older than the file
+    -n, --batch <count>      at most this many files per command
+    -j, --jobs <jobs>        run at most this many commands at once
 
 Example(s):
     Print names of text files:
@@ -25,27 +34,200 @@ Example(s):
 
     `repeatit -c "cd %f;unzip *.zip" *`
 
+    Compress only new or changed logs (incremental runs always wait):
+
+    `repeatit -i -c "gzip -kf %f" -o %f.gz *.log`
+
+    Count lines with as few commands as possible, four at a time:
+
+    `repeatit -j 4 -c "wc -l %F" *.txt`
+
 '''
 
 #internal
+import json
+import os
+import shlex
 import subprocess
+import sys
+import time
 # external
 from docopt import docopt
+from nits.reporter import Reporter
+
+MAX_ARG_STRLEN = 2**17 - 1 # Linux limit on any one argument (here: the shell's command)
+
+def expand(text, file):
+    '''
+    replace %f and %n in text
+    '''
+    return text.replace(
+        '%f', file).replace(
+        '%n', '.'.join(file.split('.')[:-1]))
+
+def expand_batch(text, files):
+    '''
+    replace %F in text with the quoted files (or add them to the end)
+    '''
+    quoted = ' '.join(shlex.quote(file) for file in files)
+    return text.replace('%F', quoted) if '%F' in text else text + ' ' + quoted
+
+def command_limit():
+    '''
+    longest command (in bytes) a shell can be started with: ARG_MAX less the environment (and some slack)
+    '''
+    try:
+        limit = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        limit = 2**15
+    environ = getattr(os, 'environb', None) or dict(
+        (os.fsencode(key), os.fsencode(value)) for key, value in os.environ.items())
+    environment = sum(len(key) + len(value) + 2 for key, value in environ.items())
+    return min(limit - environment - 2048, MAX_ARG_STRLEN)
+
+def batches(text, files, count=None, limit=None):
+    '''
+    pack files into as few batches as possible, each with at most count files
+    and expanding text into a command no longer than limit (in encoded bytes)
+    '''
+    limit = command_limit() if limit is None else limit
+    empty = len(os.fsencode(expand_batch(text, [])))
+    copies = max(1, text.count('%F')) # each file is added to every %F
+    batch, length = [], empty
+    for file in files:
+        more = (len(os.fsencode(shlex.quote(file))) + 1) * copies
+        if batch and ((count and len(batch) >= count) or length + more > limit):
+            yield batch
+            batch, length = [], empty
+        batch.append(file)
+        length += more
+    if batch:
+        yield batch
+
+def run(work, jobs=None, wait=True):
+    '''
+    start the (files, command) work, at most jobs at once, generating the (files, process) completed
+    or (files, OSError) for commands which could not be started;
+    without wait, the last commands started are left running
+    '''
+    running = []
+    def completed():
+        while True:
+            done = [x for x in running if x[1].poll() is not None]
+            if done:
+                for x in done:
+                    running.remove(x)
+                return done
+            time.sleep(.01)
+
+    for files, command in work:
+        while jobs and len(running) >= jobs:
+            yield from completed()
+        try:
+            running.append((files, subprocess.Popen(command, shell=True)))
+        except OSError as error: # e.g. E2BIG: the command is too long
+            yield files, error
+    if wait:
+        for files, process in running:
+            process.wait()
+            yield files, process
+
+def stamp(file, command):
+    '''
+    the record of a file (and command) used to decide whether it needs doing again
+    '''
+    return {
+        'file': os.path.abspath(file),
+        'mtime': os.stat(file).st_mtime,
+        'size': os.path.getsize(file),
+        'command': command}
+
+def current(state, file, command, output=None):
+    '''
+    has the file (and command) not changed since its last successful run?
+    '''
+    record = state.get(os.path.abspath(file))
+    if record is None or not os.path.exists(file) or record != stamp(file, command):
+        return False
+    elif output is None:
+        return True
+    else:
+        target = expand(output, file)
+        return os.path.exists(target) and os.stat(target).st_mtime >= record['mtime']
+
+def load(filename):
+    '''
+    the state of incremental runs: a record (see stamp) per file, one JSON record per line
+    '''
+    state = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    state[record['file']] = record
+    return state
+
+def save(state, filename):
+    '''
+    replace the state of incremental runs (atomically)
+    '''
+    temporary = filename + '.tmp'
+    with open(temporary, 'w') as f:
+        for record in state.values():
+            f.write(json.dumps(record) + '\n')
+    os.replace(temporary, filename)
+
+def positive(args, option):
+    '''
+    the (optional) positive integer value of an option, aborting on anything else
+    '''
+    value = args[option]
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        Reporter().abort(option + ' must be a positive integer', value)
+    return number
 
 def process():
-    doing = {}
     args = docopt(__doc__)
-    for file in args['<files>']:
-        doing = subprocess.Popen(
-            args['--command'].replace(
-                '%f', file).replace(
-                '%n', '.'.join(file.split('.')[:-1])
-                ),
-            shell=True)
-
-    if not args['--dontwait']:
-        for file in args['<files>']:
-            doing.wait()
+    command, incremental = args['--command'], args['--incremental']
+    files = args['<files>']
+    if incremental:
+        state = load(args['--state'])
+        files = [file for file in files if not current(state, file, command, args['--output'])]
+
+    count, jobs = positive(args, '--batch'), positive(args, '--jobs')
+    if count and '%F' not in command and ('%f' in command or '%n' in command):
+        Reporter().abort('a batch (-n) without %F cannot use %f or %n', command)
+    if '%F' in command or count:
+        work = [(batch, expand_batch(command, batch))
+            for batch in batches(command, files, count)]
+    else:
+        work = [([file], expand(command, file)) for file in files]
+
+    if incremental: # as started: commands may remove or change their files
+        stamps = dict((file, stamp(file, command)) for file in files if os.path.exists(file))
+    failed = False
+    for batch, process in run(work, jobs, incremental or not args['--dontwait']):
+        if isinstance(process, OSError):
+            failed = True
+            Reporter().warn('failed to start (' + str(process) + ')', ' '.join(batch))
+        elif process.returncode != 0:
+            failed = True
+            Reporter().warn('failed (' + str(process.returncode) + ')', ' '.join(batch))
+        elif incremental:
+            for file in batch:
+                if file in stamps:
+                    state[stamps[file]['file']] = stamps[file]
+    if incremental:
+        save(state, args['--state'])
+    if failed:
+        sys.exit(1)
 
 if __name__ == '__main__':
     process()
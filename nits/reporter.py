@@ -8,9 +8,13 @@ import sys
 
 class TimeStamp(logging.Formatter):
 
-    def __init__(self):
+    def __init__(self, worker=False):
+        '''
+        - worker: also show the name and id of the process reporting
+        '''
         super(TimeStamp, self).__init__(
-            '[%(asctime)s] %(levelname)s:%(message)s', '%Y/%m/%d %H:%M:%S')
+            '[%(asctime)s] ' + ('%(processName)s/%(process)d ' if worker else '') +
+            '%(levelname)s:%(message)s', '%Y/%m/%d %H:%M:%S')
 
     def format(self, record):
         return ''.join(super(TimeStamp, self).format(record).split('INFO:')) # delete 'INFO
@@ -20,11 +24,18 @@ class Reporter(logging.Logger):
     A simple timestamping logging class
     '''
 
-    def __init__(self, name=None, verbose=False):
+    def __init__(self, name=None, verbose=False, queue=None):
+        '''
+        - queue: send records to an Aggregator's queue (from a worker process) rather than to the screen
+        '''
         logging.Logger.__init__(self, name=name)
-        screen = logging.StreamHandler(sys.stdout)
-        screen.setFormatter(TimeStamp())
-        self.addHandler(screen)
+        if queue is None:
+            screen = logging.StreamHandler(sys.stdout)
+            screen.setFormatter(TimeStamp())
+            self.addHandler(screen)
+        else:
+            from logging.handlers import QueueHandler # (imported only when aggregating, as for Aggregator)
+            self.addHandler(QueueHandler(queue))
         if verbose:
             self.setLevel(logging.INFO)
         else:
@@ -52,3 +63,54 @@ class Reporter(logging.Logger):
         message = self._target(message, target)
         self.error(message)
         sys.exit(-1)
+
+class Aggregator:
+    '''
+    Write the records of Reporters in worker processes from a single thread of this process:
+    workers send records over the (multiprocessing) queue, given as Reporter(queue=aggregator.queue),
+    and the aggregator writes them in batches, in time order within a batch, showing each worker.
+    Create it before the worker processes so that they can inherit its queue.
+    '''
+
+    def __init__(self, stream=None, batch=1000):
+        '''
+        - stream: where to write (default: standard output)
+        - batch: most records written at once
+        '''
+        import multiprocessing
+        import threading
+        self.stream, self.batch = stream or sys.stdout, batch
+        self.queue = multiprocessing.Queue()
+        self.formatter = TimeStamp(worker=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        from queue import Empty
+        done = False
+        while not done:
+            records = [self.queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            done = None in records
+            records = sorted([r for r in records if r is not None], key=lambda r: r.created)
+            if records:
+                self.stream.write(''.join(self.formatter.format(r) + '\n' for r in records))
+                self.stream.flush()
+
+    def stop(self):
+        '''
+        write the remaining records and stop
+        '''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.stop()
@@ -3,15 +3,31 @@ Description:
     Convenience functions and constants to deal with python's eclectic date-time packaging conventions
 '''
 # external
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
 from datetime import datetime
+import functools
 import math
+import operator
 import os
+import re
+import stat
+import tempfile
+import threading
+import time
 import unittest
+# optional
+try:
+    from zoneinfo import ZoneInfo # python 3.9+
+except ImportError:
+    ZoneInfo = None
 
 EPOCH = datetime.utcfromtimestamp(0)
 DEFAULT_TIME_STAMP = '%H:%M:%S'
 DEFAULT_DATE_STAMP = '%Y%m%d'
 DEFAULT_DATETIME_STAMP = DEFAULT_DATE_STAMP + ' ' + DEFAULT_TIME_STAMP
+DAY_DIRECTIVES = set('aAbBCdDeFgGhjmnotuUVwWxyYzZ%') # strftime directives constant within a (local) day
 
 def date2unix(d):
     '''
@@ -28,7 +44,7 @@ def now2unix():
     '''
     current time in UNIX format
     '''
-    return date2unix(datetime.utcnow())
+    return time.time()
 
 def now2time():
     '''
@@ -42,19 +58,39 @@ def now2str(format=DEFAULT_DATETIME_STAMP):
     '''
     return datetime.now().strftime(format)
 
-def str2unix(s, format=DEFAULT_DATETIME_STAMP): # string -> unix seconds
+def str2unix(s, format=DEFAULT_DATETIME_STAMP, tz=None): # string -> unix seconds
     '''
-    parse string to UNIX time format
+    parse string (local to the named time zone tz, if any) to UNIX time format
     '''
+    if tz is not None:
+        return zone(tz).str2unix(s, format)
     return date2unix(datetime.strptime(s, format))
 
-def unix2str(u, format=DEFAULT_DATETIME_STAMP, zone_offset=0): # unix seconds -> string
+def unix2str(u, format=DEFAULT_DATETIME_STAMP, zone_offset=0, tz=None): # unix seconds -> string
     '''
-    create string from UNIX time forfmat
+    create string from UNIX time forfmat, offset by zone_offset hours or in the named time zone tz
     '''
+    if tz is not None:
+        return zone(tz).unix2str(u, format)
     u = u + (zone_offset * 3600)
     return datetime.strftime(unix2date(u), format)
 
+def unix2strs(us, format=DEFAULT_DATETIME_STAMP, zone_offset=0, tz=None):
+    '''
+    create strings from many UNIX times (see unix2str)
+    '''
+    if tz is not None:
+        return zone(tz).unix2strs(us, format)
+    return [unix2str(u, format, zone_offset) for u in us]
+
+def str2unixs(ss, format=DEFAULT_DATETIME_STAMP, tz=None):
+    '''
+    parse many strings to UNIX time format (see str2unix)
+    '''
+    if tz is not None:
+        return zone(tz).str2unixs(ss, format)
+    return [str2unix(s, format) for s in ss]
+
 def time2date(t):
     return datetime.combine(datetime.today(), t)
 
@@ -70,6 +106,298 @@ def time2file(f, time):
     '''
     os.utime(f, (time, time))
 
+class Zone:
+    '''
+    A named time zone whose UTC offsets are precomputed (from zoneinfo) as a table of
+    transitions between the years start and end, searched by bisection;
+    times outside of those years are converted by zoneinfo directly
+    '''
+
+    STEP = 7 * 24 * 3600 # transitions are assumed to be at least this far (seconds) apart
+
+    def __init__(self, name, start=1900, end=2100):
+        if ZoneInfo is None:
+            raise ImportError('named time zones require zoneinfo (python 3.9+)')
+        self.name, self.zone = name, ZoneInfo(name)
+        self.first = int(date2unix(datetime(start, 1, 1)))
+        self.last = int(date2unix(datetime(end, 1, 1)))
+        self.transitions, self.offsets, self.names = [], [], []
+        u, current = self.first, self._state(self.first)
+        self._add(u, current)
+        while u < self.last:
+            v = min(u + self.STEP, self.last)
+            if self._state(v) == current:
+                u = v
+            else: # find the first second of the new state
+                while v - u > 1:
+                    middle = (u + v) // 2
+                    if self._state(middle) == current:
+                        u = middle
+                    else:
+                        v = middle
+                u, current = v, self._state(v)
+                self._add(u, current)
+
+    def _state(self, u):
+        d = datetime.fromtimestamp(u, self.zone)
+        return d.utcoffset().total_seconds(), d.tzname()
+
+    def _add(self, u, state):
+        self.transitions.append(u)
+        self.offsets.append(state[0])
+        self.names.append(state[1])
+
+    def _index(self, u):
+        if self.first <= u < self.last:
+            return bisect_right(self.transitions, u) - 1
+        return None
+
+    def offset(self, u):
+        '''
+        UTC offset (in seconds) at UNIX time u
+        '''
+        i = self._index(u)
+        return self._state(u)[0] if i is None else self.offsets[i]
+
+    @staticmethod
+    def _zoned(format, offset, name):
+        '''
+        format with %Z and %z replaced by the name and offset (+HHMM, or +HHMMSS as zoneinfo does)
+        '''
+        if '%z' in format or '%Z' in format:
+            minutes, seconds = divmod(int(abs(offset)), 60)
+            format = format.replace('%Z', name).replace('%z', ('-' if offset < 0 else '+')
+                + str(minutes // 60).zfill(2) + str(minutes % 60).zfill(2)
+                + (str(seconds).zfill(2) if seconds else ''))
+        return format
+
+    def _format(self, i, u, format):
+        if i is None:
+            offset, name = self._state(u)
+        else:
+            offset, name = self.offsets[i], self.names[i]
+        return datetime.strftime(unix2date(u + offset), self._zoned(format, offset, name))
+
+    @staticmethod
+    def _split(format):
+        '''
+        split a format into (date prefix, time of day, date suffix) around its %H, %M and %S directives,
+        or None if the time of day is not just those (and text) or other directives depend on it
+        '''
+        directives = list(re.finditer('%.', format))
+        times = [m for m in directives if m.group()[1] in 'HMS']
+        if any(m.group()[1] not in DAY_DIRECTIVES for m in directives if m not in times):
+            return None
+        elif not times:
+            return format, '', ''
+        start, end = times[0].start(), times[-1].end()
+        if '%' in re.sub('%[HMS]', '', format[start:end]):
+            return None
+        return format[:start], format[start:end], format[end:]
+
+    def unix2str(self, u, format=DEFAULT_DATETIME_STAMP):
+        '''
+        create local string from UNIX time
+        '''
+        return self._format(self._index(u), u, format)
+
+    def unix2strs(self, us, format=DEFAULT_DATETIME_STAMP):
+        '''
+        create local strings from many UNIX times: formats whose time of day is just %H, %M and %S
+        (between date directives) are formatted by date once per local day, and by time arithmetically
+        '''
+        index, convert = self._index, self._format
+        split = self._split(format)
+        if split is None:
+            return [convert(index(u), u, format) for u in us]
+        prefix, middle, suffix = split
+        clock = re.sub('%[HMS]', '%02d', middle) # as %-formatting of (hours, minutes, seconds)
+        pick = operator.itemgetter(*['HMS'.index(c) for c in re.findall('%([HMS])', middle)]) \
+            if middle else None
+        bounds = self.transitions[1:] + [self.last]
+        start = end = offset = i = 0 # of the transition (range) last used, reused while sorted
+        days, pieces, strings = {}, {}, []
+        for u in us:
+            if not start <= u < end:
+                i = index(u)
+                if i is None:
+                    start = end = 0
+                    strings.append(convert(i, u, format))
+                    continue
+                start, end, offset = self.transitions[i], bounds[i], self.offsets[i]
+            local = u + offset
+            whole = int(local // 1)
+            if local - whole >= .999999: # rounded up to the next second by unix2date
+                strings.append(convert(i, u, format))
+                continue
+            day, second = divmod(whole, 86400)
+            dated = days.get((day, i))
+            if dated is None:
+                zoned = pieces.get(i)
+                if zoned is None:
+                    zoned = pieces[i] = [self._zoned(piece, offset, self.names[i])
+                        for piece in (prefix, suffix)]
+                midnight = unix2date(day * 86400)
+                dated = days[(day, i)] = (datetime.strftime(midnight, zoned[0]),
+                    datetime.strftime(midnight, zoned[1]) if '%' in zoned[1] else zoned[1])
+            if pick is None:
+                strings.append(dated[0] + dated[1])
+            else:
+                hms = (second // 3600, second // 60 % 60, second % 60)
+                strings.append(dated[0] + clock % pick(hms) + dated[1])
+        return strings
+
+    def str2unix(self, s, format=DEFAULT_DATETIME_STAMP):
+        '''
+        parse local string to UNIX time format, as zoneinfo does (fold=0): ambiguous times
+        and times skipped by a transition are taken with the offset in effect before it
+        '''
+        local = date2unix(datetime.strptime(s, format))
+        before, after = self.offset(local - 3 * 86400), self.offset(local + 3 * 86400) # (STEP apart)
+        if before != after and self.offset(local - before) != before and self.offset(local - after) == after:
+            return local - after
+        return local - before
+
+    def str2unixs(self, ss, format=DEFAULT_DATETIME_STAMP):
+        '''
+        parse many local strings to UNIX time format
+        '''
+        return [self.str2unix(s, format) for s in ss]
+
+@functools.lru_cache(maxsize=None)
+def zone(name):
+    '''
+    the (cached) Zone of a time zone name, e.g. 'America/Chicago'
+    '''
+    return Zone(name)
+
+def files2time(files, workers=16, sort=False):
+    '''
+    get last modification times of many files, with concurrent stat calls:
+    a dictionary of file to time, or (if sort) a sorted list of files and an array of their times
+    '''
+    files = list(files)
+    with ThreadPoolExecutor(workers) as pool:
+        times = dict(zip(files, pool.map(file2time, files)))
+    return _sorted(times) if sort else times
+
+def folder2time(folder, recursive=True, workers=16, sort=False, chunk=256):
+    '''
+    get last modification times of the files in a folder (tree), scanning folders
+    and stat-ing their entries (chunk at a time) concurrently; returns as files2time.
+    Links are followed as by file2time, except that links to folders are neither
+    recorded nor scanned, and broken links are left out
+    '''
+    def scan(path):
+        entries, folders = [], []
+        with os.scandir(path) as found:
+            for entry in found:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                else:
+                    entries.append(entry)
+        return entries, folders
+
+    def times_of(entries):
+        times = {}
+        for entry in entries:
+            try:
+                status = entry.stat() # (follows links)
+            except FileNotFoundError: # vanished, or a broken link
+                continue
+            if not stat.S_ISDIR(status.st_mode):
+                times[entry.path] = status.st_mtime
+        return times
+
+    times, pending, stats = {}, [folder], []
+    with ThreadPoolExecutor(workers) as pool:
+        while pending:
+            found = []
+            for entries, folders in pool.map(scan, pending):
+                stats += [pool.submit(times_of, entries[i:i + chunk]) for i in range(0, len(entries), chunk)]
+                found += folders
+            pending = found if recursive else []
+        for future in stats:
+            times.update(future.result())
+    return _sorted(times) if sort else times
+
+def time2files(times, workers=16):
+    '''
+    stamp modification times on many files (a dictionary of file to time), with concurrent utime calls
+    '''
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(time2file, times.keys(), times.values()))
+
+def _sorted(times):
+    files = sorted(times)
+    return files, array('d', [times[f] for f in files])
+
+class Clock:
+    '''
+    A coarse clock for cheap timestamps in hot loops: the current time and its strings
+    are recomputed at most once every `resolution` seconds, either
+
+    - by a background thread (thread=True), so reading `unix` or `stamp` is an attribute read
+    - when asked through now2unix() and now2str() (thread=False), at the cost of a monotonic check
+    '''
+
+    def __init__(self, resolution=1.0, formats=(DEFAULT_DATETIME_STAMP,), thread=True):
+        '''
+        - resolution: seconds between updates
+        - formats: string formats kept up to date (others are added when first asked for)
+        - thread: update from a background thread?
+        '''
+        self.resolution, self.thread = resolution, thread
+        self.formats = list(formats)
+        if DEFAULT_DATETIME_STAMP not in self.formats:
+            self.formats.append(DEFAULT_DATETIME_STAMP)
+        self.tick()
+        if thread:
+            self._stop = threading.Event()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def tick(self):
+        '''
+        recompute the time and its strings
+        '''
+        now = time.time()
+        local = datetime.fromtimestamp(now)
+        self.strings = dict((format, local.strftime(format)) for format in self.formats)
+        self.unix, self.stamp = now, self.strings[DEFAULT_DATETIME_STAMP]
+        self.due = time.monotonic() + self.resolution
+
+    def _run(self):
+        while not self._stop.wait(self.resolution):
+            self.tick()
+
+    def stop(self):
+        '''
+        stop updating from the background thread
+        '''
+        if self.thread:
+            self._stop.set()
+
+    def now2unix(self):
+        '''
+        (coarse) current time in UNIX format
+        '''
+        if not self.thread and time.monotonic() >= self.due:
+            self.tick()
+        return self.unix
+
+    def now2str(self, format=DEFAULT_DATETIME_STAMP):
+        '''
+        (coarse) current time in string format
+        '''
+        if not self.thread and time.monotonic() >= self.due:
+            self.tick()
+        try:
+            return self.strings[format]
+        except KeyError:
+            self.formats.append(format)
+            self.tick()
+            return self.strings[format]
+
 class Test_Time(unittest.TestCase):
     '''
     Regression tests for time
@@ -86,6 +414,76 @@ class Test_Time(unittest.TestCase):
         assert unix2str(str2unix(s)) == s
         x += .03
         assert math.isclose(date2unix(unix2date(x)), x)
+        assert abs(now2unix() - date2unix(datetime.utcnow())) < 1
+
+    @unittest.skipIf(ZoneInfo is None, 'requires zoneinfo')
+    def test_zone(self):
+        chicago = ZoneInfo('America/Chicago')
+        spring = str2unix('20210314 08:00:00') # 2 AM CST -> 3 AM CDT
+        assert unix2str(spring - 1, tz='America/Chicago') == '20210314 01:59:59'
+        assert unix2str(spring, DEFAULT_DATETIME_STAMP + ' %Z%z', tz='America/Chicago') == \
+            '20210314 03:00:00 CDT-0500'
+        us = range(int(str2unix('20201101 00:00:00')), int(str2unix('20201102 00:00:00')), 997)
+        expected = [datetime.fromtimestamp(u, chicago).strftime(DEFAULT_DATETIME_STAMP) for u in us]
+        assert unix2strs(us, tz='America/Chicago') == expected
+        assert str2unixs(expected[:20], tz='America/Chicago') == list(us[:20])
+        early = str2unix('18000101 00:00:00') # outside of the table
+        assert unix2str(early, tz='America/Chicago') == \
+            datetime.fromtimestamp(early, chicago).strftime(DEFAULT_DATETIME_STAMP)
+        amsterdam = str2unix('19340601 12:00:00') # +01:19:32
+        assert unix2str(amsterdam, '%z', tz='Europe/Amsterdam') == \
+            datetime.fromtimestamp(amsterdam, ZoneInfo('Europe/Amsterdam')).strftime('%z') == '+011932'
+        for name, s in [ # ambiguous (fall back) and skipped (spring forward) times, west and east of UTC
+            ('America/Chicago', '20201101 01:30:00'), ('America/Chicago', '20200308 02:30:00'),
+            ('Europe/Berlin', '20201025 02:30:00'), ('Europe/Berlin', '20200329 02:30:00'),
+            ('Australia/Sydney', '20200405 02:30:00'), ('Australia/Sydney', '20201004 02:30:00')]:
+            expected = datetime.strptime(s, DEFAULT_DATETIME_STAMP).replace(tzinfo=ZoneInfo(name)).timestamp()
+            assert str2unix(s, tz=name) == expected
+
+    @unittest.skipIf(ZoneInfo is None, 'requires zoneinfo')
+    def test_zone_bulk(self):
+        chicago = ZoneInfo('America/Chicago')
+        us = [early + i * 3.7 for early in [str2unix('18991231 12:00:00'), 1.6e9, 1.6e9 - .0000001]
+            for i in range(5000)] + [str2unix('21000101 05:00:00') + i for i in range(50)]
+        for format in [DEFAULT_DATETIME_STAMP, '%Y-%m-%dT%H:%M:%S%z', '%H%M %Z', '%x %I:%M %p', '%%H%Y']:
+            expected = [datetime.fromtimestamp(u, chicago).strftime(format) for u in us]
+            assert unix2strs(us, format, tz='America/Chicago') == expected
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as folder:
+            os.mkdir(os.path.join(folder, 'sub'))
+            files = [os.path.join(folder, name) for name in ['a', 'b', os.path.join('sub', 'c')]]
+            for i, file in enumerate(files):
+                open(file, 'w').close()
+            time2files(dict((file, 1.27e9 + i) for i, file in enumerate(files)))
+            times = folder2time(folder)
+            assert times == files2time(files) == dict((f, 1.27e9 + i) for i, f in enumerate(files))
+            assert len(folder2time(folder, recursive=False)) == 2
+            names, stamps = folder2time(folder, sort=True)
+            assert names == sorted(files) and list(stamps) == [times[f] for f in names]
+            os.symlink(files[0], os.path.join(folder, 'link'))
+            os.symlink(os.path.join(folder, 'sub'), os.path.join(folder, 'folder link'))
+            os.symlink(os.path.join(folder, 'missing'), os.path.join(folder, 'broken link'))
+            flat = os.path.join(folder, 'flat')
+            os.mkdir(flat)
+            many = [os.path.join(flat, str(i)) for i in range(100)]
+            for file in many:
+                open(file, 'w').close()
+            time2files(dict((file, 1.28e9) for file in many))
+            times = folder2time(folder, chunk=7)
+            assert times[os.path.join(folder, 'link')] == times[files[0]] # as file2time
+            assert len(times) == len(files) + 1 + len(many) and times[many[-1]] == 1.28e9
+
+    def test_clock(self):
+        for thread in [False, True]:
+            clock = Clock(resolution=.01, thread=thread)
+            first = clock.now2unix()
+            assert abs(first - now2unix()) < 1
+            assert len(clock.now2str()) == len(clock.stamp) == len(now2str())
+            assert clock.now2str('%Y') == now2str('%Y')
+            time.sleep(.05)
+            assert clock.now2unix() > first
+            clock.stop()
 
 if __name__ == '__main__':
     unittest.main()
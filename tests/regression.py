@@ -1,13 +1,124 @@
 # standard
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
 import unittest
 # import the unittests ...
 from nits.file import Test_File
 from nits.time import Test_Time
 from nits.cast import Test_Cast
+from nits.cache import Test_Cache
+# ... and test the modules every tool imports (and so which do not import unittest) here
+from nits.reporter import Aggregator, Reporter
+from nits import repeatit
 
 '''
 Run regression tests on the base Encyclopedia classes
 '''
 
+def _work(queue, n): # a worker process reporting through an Aggregator
+    reporter = Reporter(verbose=True, queue=queue)
+    for i in range(n):
+        reporter.say('working', i)
+
+class Test_Reporter(unittest.TestCase):
+
+    def test_aggregator(self):
+        stream = io.StringIO()
+        with Aggregator(stream) as aggregator:
+            workers = [multiprocessing.Process(target=_work, args=(aggregator.queue, 50), name='w' + str(i))
+                for i in range(3)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 150
+        for i in range(3):
+            mine = [line for line in lines if ' w' + str(i) + '/' in line]
+            assert len(mine) == 50 and mine[-1].endswith('working[49]') and 'INFO' not in mine[0]
+
+class Test_Repeatit(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.folder.name, 'a.txt')
+        with open(self.file, 'w') as f:
+            f.write('a')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def touch(self, filename, mtime):
+        with open(filename, 'a'):
+            pass
+        os.utime(filename, (mtime, mtime))
+
+    def test_current(self):
+        self.touch(self.file, 1e9)
+        record = repeatit.stamp(self.file, 'gzip %f')
+        assert record['file'] == os.path.abspath(self.file) and record['size'] == 1
+        state = {record['file']: record}
+        assert repeatit.current(state, self.file, 'gzip %f')
+        assert not repeatit.current(state, self.file, 'bzip2 %f') # another command
+        assert not repeatit.current({}, self.file, 'gzip %f') # never run
+        output = self.file + '.out'
+        assert not repeatit.current(state, self.file, 'gzip %f', '%f.out') # output missing
+        self.touch(output, 1e9 - 1)
+        assert not repeatit.current(state, self.file, 'gzip %f', '%f.out') # output stale
+        self.touch(output, 1e9 + 1)
+        assert repeatit.current(state, self.file, 'gzip %f', '%f.out')
+        self.touch(self.file, 1e9 + 2) # changed
+        assert not repeatit.current(state, self.file, 'gzip %f')
+        os.remove(self.file)
+        assert not repeatit.current(state, self.file, 'gzip %f')
+
+    def test_state(self):
+        filename = os.path.join(self.folder.name, 'state.jsonl')
+        assert repeatit.load(filename) == {}
+        record = repeatit.stamp(self.file, 'echo %f')
+        repeatit.save({record['file']: record}, filename)
+        assert repeatit.load(filename) == {record['file']: record}
+        assert sorted(os.listdir(self.folder.name)) == ['a.txt', 'state.jsonl'] # (no temporary left)
+
+    def test_batches(self):
+        files = ['a', 'b c', 'd', 'e']
+        assert list(repeatit.batches('wc %F', files, count=3)) == [['a', 'b c', 'd'], ['e']]
+        empty = len('wc ') # each file adds its quoted name and a space, in bytes, to every %F
+        assert list(repeatit.batches('wc %F', files, limit=empty + 2 + 6)) == [['a', 'b c'], ['d', 'e']]
+        names = ['\u6587\u4ef6' * 10 + str(i) for i in range(4)] # quoted: 63 bytes (but 23 characters)
+        assert [len(batch) for batch in repeatit.batches('wc %F', names, limit=empty + 2 * 64)] == [2, 2]
+        assert [len(batch) for batch in repeatit.batches('wc %F %F', names, limit=empty + 1 + 2 * 64)] == [1] * 4
+        assert list(repeatit.batches('wc', ['x'] * 3, count=2)) == [['x', 'x'], ['x']]
+
+    def test_run(self):
+        running = os.path.join(self.folder.name, 'running')
+        os.mkdir(running)
+        counts = os.path.join(self.folder.name, 'counts')
+        work = [([str(i)], 'ls {0} | wc -l >> {1}; touch {0}/{2}; sleep .05; rm {0}/{2}; exit {3}'.format(
+            running, counts, i, i % 3)) for i in range(6)]
+        done = dict((files[0], process.returncode) for files, process in repeatit.run(work, jobs=2))
+        assert done == dict((str(i), i % 3) for i in range(6))
+        with open(counts) as f:
+            assert max(int(line) for line in f) <= 1 # at most one other command running
+        failed = list(repeatit.run([(['x'], 'true ' + 'x' * repeatit.MAX_ARG_STRLEN)]))
+        assert failed[0][0] == ['x'] and isinstance(failed[0][1], OSError)
+
+    def test_options(self):
+        argv = sys.argv
+        try:
+            for option in ['-n', '-j']:
+                for value in ['x', '0']:
+                    sys.argv = ['repeatit', '-c', 'true', '-d', option, value, self.file]
+                    with self.assertRaises(SystemExit):
+                        repeatit.process()
+            sys.argv = ['repeatit', '-c', 'echo %f', '-n', '2', self.file]
+            with self.assertRaises(SystemExit):
+                repeatit.process()
+        finally:
+            sys.argv = argv
+
 if __name__ == '__main__':
     unittest.main()